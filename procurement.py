@@ -1,22 +1,213 @@
 import datetime
+import hashlib
 import json
+import re
 import sys
 
+import numpy as np
 import pandas as pd
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
 
 
-def load_and_prepare_data(file_path, supplier_name_from_ui, product_name_col, spec_col_name, price_col):  # spec_col_name can be None
+# 表头识别用的同义词表，键为程序内部使用的标准列名
+HEADER_SYNONYMS = {
+    '品名': ('品名', '商品名称', '产品名称', '商品名', '产品名', '货品名称', '物料名称', '品名称', '名称', '商品', '产品', '品种', '菜品'),
+    '规格': ('规格', '规格型号', '型号', '规格/型号', '包装规格', '尺寸', '等级', '规格说明'),
+    '价格': ('价格', '单价', '报价', '售价', '含税单价', '销售价', '供货价', '单价(元)', '价格(元)', '报价(元)'),
+}
+HEADER_SNIFF_ROWS = 30  # 每个工作表最多读取的行数
+FINGERPRINT_BYTES = 64 * 1024
+
+# 全角字符 (！到～、￥) 转半角并删除各类空白，用于清洗价格文本
+FULL_WIDTH_TRANSLATION = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+FULL_WIDTH_TRANSLATION.update({0xFFE5: ord('¥')})
+FULL_WIDTH_TRANSLATION.update({ord(ch): None for ch in ' \t\r\n\u3000\xa0'})
+THOUSANDS_SEPARATOR_PATTERN = re.compile(r'(?<=\d),(?=\d{3}(?!\d))')
+# 例: "12.5元/斤"、"¥8"、"8.00元"、"RMB 3.5 / kg"、"5块每斤"
+PRICE_TEXT_PATTERN = re.compile(
+    r'^(?:¥|\$|rmb|人民币)?(?P<price>[-+]?\d+(?:\.\d+)?|[-+]?\.\d+)(?:元|块|圆|rmb)?(?:(?:/|每)(?P<unit>.+))?$',
+    re.IGNORECASE)
+
+
+def _normalize_header_text(value):
+    if value is None:
+        return ""
+    text = str(value).strip().lower()
+    # 全角括号/斜杠统一成半角，去掉空白
+    text = text.replace('（', '(').replace('）', ')').replace('／', '/')
+    return "".join(text.split())
+
+
+def _score_header_cell(cell_text, synonyms):
+    """完全匹配计 3 分，包含同义词计 1 分 (如 '单价(元/斤)')，否则 0 分"""
+    if not cell_text:
+        return 0
+    best = 0
+    for synonym in synonyms:
+        if cell_text == synonym:
+            return 3
+        if synonym in cell_text:
+            best = 1
+    return best
+
+
+def score_header_row(row_values):
+    """为一行候选表头打分，返回 (总分, {标准列名: (列序号, 原始表头)})"""
+    normalized = [_normalize_header_text(v) for v in row_values]
+    mapping = {}
+    total = 0
+    used_cols = set()
+    for field in ('品名', '价格', '规格'):  # 先定必需列，避免规格抢占品名/价格列
+        best_score, best_col = 0, None
+        for col_idx, cell_text in enumerate(normalized):
+            if col_idx in used_cols:
+                continue
+            score = _score_header_cell(cell_text, HEADER_SYNONYMS[field])
+            if score > best_score:
+                best_score, best_col = score, col_idx
+        if best_col is not None:
+            used_cols.add(best_col)
+            mapping[field] = (best_col, str(row_values[best_col]))
+            total += best_score
+    return total, mapping
+
+
+def _iter_candidate_sheet_rows(file_path, max_rows):
+    """只读取候选工作表 (可见且非空) 的前 max_rows 行"""
+    if file_path.lower().endswith('.xlsx') or file_path.lower().endswith('.xlsm'):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for ws in wb.worksheets:
+                if ws.sheet_state != 'visible':
+                    continue
+                rows = [list(r) for r in ws.iter_rows(min_row=1, max_row=max_rows, values_only=True)]
+                if any(v is not None for r in rows for v in r):
+                    yield ws.title, rows
+        finally:
+            wb.close()
+    else:
+        # 旧版 .xls 没有只读流式接口，用 nrows 限制读取行数
+        sheets = pd.read_excel(file_path, sheet_name=None, header=None, nrows=max_rows)
+        for sheet_name, sheet_df in sheets.items():
+            if sheet_df.empty:
+                continue
+            yield sheet_name, sheet_df.astype(object).where(sheet_df.notna(), None).values.tolist()
+
+
+def sniff_header(file_path, typed_columns=None, max_rows=HEADER_SNIFF_ROWS):
+    """
+    在不完整读取文件的情况下定位表头：逐个候选工作表读取前 max_rows 行。
+    typed_columns 为用户填写的列名 {标准列名: 列名}：按工作表和行的顺序，第一个同时包含
+    填写的品名列和价格列的行直接胜出 (因此第一个工作表首行符合时与不识别时读取的位置一致)；
+    没有这样的行时，按同义词表为每一行打分，取得分最高者。
+    返回 {sheet, header_row, columns, header_values, score, typed_match}；
+    未找到同时包含品名列和价格列的行时返回 None。
+    """
+    typed_columns = {field: name.strip() for field, name in (typed_columns or {}).items() if name and name.strip()}
+    match_typed = '品名' in typed_columns and '价格' in typed_columns
+    best = None
+    for sheet_name, rows in _iter_candidate_sheet_rows(file_path, max_rows):
+        for row_idx, row_values in enumerate(rows):
+            header_values = [str(v).strip() for v in row_values if v is not None and str(v).strip()]
+            score, mapping = score_header_row(row_values)
+            columns = {field: header for field, (_, header) in mapping.items()}
+            if match_typed and typed_columns['品名'] in header_values and typed_columns['价格'] in header_values:
+                columns.update({field: name for field, name in typed_columns.items() if name in header_values})
+                return {'sheet': sheet_name, 'header_row': row_idx, 'columns': columns,
+                        'header_values': header_values, 'score': score, 'typed_match': True}
+            if '品名' not in mapping or '价格' not in mapping:
+                continue
+            if best is None or score > best['score']:
+                best = {'sheet': sheet_name, 'header_row': row_idx, 'columns': columns,
+                        'header_values': header_values, 'score': score, 'typed_match': False}
+    return best
+
+
+def file_fingerprint(file_path):
+    """文件指纹：大小 + 修改时间 + 文件头部内容的摘要，用于记忆列映射"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+    return f"{stat.st_size}-{int(stat.st_mtime)}-{digest.hexdigest()}"
+
+
+def _classify_price_cell_type(cell_type):
+    if issubclass(cell_type, str):
+        return 'text'
+    if issubclass(cell_type, (bool, np.bool_)):
+        return 'bool'
+    if issubclass(cell_type, (int, float, np.integer, np.floating)):
+        return 'number'
+    if issubclass(cell_type, (datetime.date, datetime.time, datetime.timedelta, np.datetime64, np.timedelta64)):
+        return 'datetime'
+    return 'other'
+
+
+def _parse_price_values(values):
+    """解析一组 (去重后的) 价格单元格，返回 价格 / 单位 / 拒绝原因 三列"""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        text_mask = pd.Series(False, index=values.index)
+        other_mask = text_mask
+    else:
+        # 按单元格类型分流：不同类型只有寥寥几种，先对类型分类再映射回每个值
+        cell_types = values.map(type)
+        cell_kinds = cell_types.map({t: _classify_price_cell_type(t) for t in pd.unique(cell_types)})
+        text_mask = cell_kinds.eq('text')
+        other_mask = ~text_mask & ~cell_kinds.eq('number') & values.notna()
+    result = pd.DataFrame({
+        '价格': pd.to_numeric(values.where(~text_mask & ~other_mask), errors='coerce').astype(float),
+        '单位': pd.Series(None, index=values.index, dtype=object),
+        '拒绝原因': pd.Series(None, index=values.index, dtype=object),
+    })
+    if other_mask.any():
+        # 布尔、日期等单元格不是价格，单独给出原因而不是按 1.0 / NaN 处理
+        result.loc[other_mask, '拒绝原因'] = cell_kinds[other_mask].map(
+            {'bool': "布尔值不是价格", 'datetime': "日期/时间不是价格"}).fillna("不支持的单元格类型")
+    if text_mask.any():
+        texts = values[text_mask].str.translate(FULL_WIDTH_TRANSLATION)
+        has_separator = texts.str.contains(',', regex=False)
+        if has_separator.any():
+            texts[has_separator] = texts[has_separator].str.replace(THOUSANDS_SEPARATOR_PATTERN, '', regex=True)
+        extracted = texts.str.extract(PRICE_TEXT_PATTERN)
+        result.loc[text_mask, '价格'] = pd.to_numeric(extracted['price'], errors='coerce')
+        result.loc[text_mask, '单位'] = extracted['unit']
+        unmatched = extracted['price'].isna() & (texts != "")
+        result.loc[unmatched[unmatched].index, '拒绝原因'] = "无法识别的价格格式"
+    non_positive = result['价格'] <= 0
+    result.loc[non_positive, '拒绝原因'] = "价格必须大于 0"
+    result.loc[non_positive, '价格'] = float('nan')
+    return result
+
+
+def extract_prices(price_series):
+    """
+    向量化清洗价格列：数值单元格直接使用，文本单元格统一全角字符后用正则提取价格与单位。
+    返回与 price_series 同索引的 DataFrame，列为 价格 / 单位 / 拒绝原因；空单元格价格为 NaN 且不计为拒绝。
+    报价单中的取值大量重复，因此先 factorize，只解析不重复的值再按编码映射回每一行。
+    """
+    if pd.api.types.is_numeric_dtype(price_series):
+        return _parse_price_values(price_series)
+    codes, uniques = pd.factorize(price_series, use_na_sentinel=True)
+    parsed = _parse_price_values(pd.Series(uniques, dtype=object))
+    # 末尾追加一行空值，供 factorize 的 -1 (空单元格) 编码取用
+    parsed.loc[len(parsed)] = [float('nan'), None, None]
+    result = parsed.take(np.where(codes < 0, len(parsed) - 1, codes))
+    result.index = price_series.index
+    return result
+
+
+def load_and_prepare_data(file_path, supplier_name_from_ui, product_name_col, spec_col_name, price_col, sheet_name=0, header_row=0):  # spec_col_name can be None
     try:
         if not os.path.exists(file_path):
             messagebox.showerror("文件错误", f"文件未找到: {file_path}")
             return None
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row)
 
         if product_name_col in df.columns:
             df[product_name_col] = df[product_name_col].ffill() # Forward fill 品名列
@@ -53,18 +244,24 @@ def load_and_prepare_data(file_path, supplier_name_from_ui, product_name_col, sp
         else:
             df_selected['规格'] = ""  # 如果没有规格列，则规格默认为空字符串
 
-        df_selected['价格'] = pd.to_numeric(df_selected['价格'], errors='coerce')
+        price_info = extract_prices(df_selected['价格'])
+        rejected = price_info['拒绝原因'].notna()
+        # 记录被拒绝的价格单元格 (Excel 行号, 原始值, 原因)，由调用方汇总提示
+        rejected_rows = list(zip((df_selected.index[rejected] + header_row + 2).tolist(),
+                                 df_selected.loc[rejected, '价格'].astype(str).tolist(),
+                                 price_info.loc[rejected, '拒绝原因'].tolist()))
+        df_selected['价格'] = price_info['价格']
+        df_selected['单位'] = price_info['单位']
 
-        df_selected['产品标识符'] = df_selected.apply(
-            lambda row: f"{row['品名']}|{row['规格']}" if row['规格'] else row['品名'],
-            axis=1
-        )
+        df_selected['产品标识符'] = df_selected['品名'].where(
+            df_selected['规格'] == "", df_selected['品名'] + "|" + df_selected['规格'])
 
         df_selected.dropna(subset=['品名', '价格', '产品标识符'], inplace=True)
         df_selected = df_selected[df_selected['价格'] > 0]
 
         if df_selected.empty:
             messagebox.showwarning("数据警告", f"{supplier_name_from_ui} 的文件 '{os.path.basename(file_path)}' 中没有找到有效的带价格的产品数据。")
+        df_selected.attrs['价格拒绝行'] = rejected_rows
         return df_selected
     except Exception as e:
         messagebox.showerror("加载错误", f"加载 {supplier_name_from_ui} 的文件 '{os.path.basename(file_path)}' 失败: {e}")
@@ -126,16 +323,17 @@ def parse_procurement_input(procurement_text):
 
 
 def generate_purchase_plan(supplier_dataframes_dict, procurement_needs_internal, current_supplier_display_names):
-    # (这个函数在上一版中已确认无误，保持不变)
+    # 返回 (采购明细, 各供应商合计, 备注, 假设分析用的报价结构 build_top_offers)
     valid_supplier_dfs_list = [df for df in supplier_dataframes_dict.values() if df is not None and not df.empty]
     if not valid_supplier_dfs_list:
         messagebox.showerror("数据错误", "没有可用的供应商数据进行比价。")
-        return pd.DataFrame(), {}, ["没有加载到任何有效的供应商报价数据。"]
+        return pd.DataFrame(), {}, ["没有加载到任何有效的供应商报价数据。"], None
     all_prices_df = pd.concat(valid_supplier_dfs_list, ignore_index=True)
     if all_prices_df.empty:
         messagebox.showerror("数据错误", "所有供应商的报价数据均为空或无效。")
-        return pd.DataFrame(), {}, ["所有供应商的报价数据均为空或无效。"]
+        return pd.DataFrame(), {}, ["所有供应商的报价数据均为空或无效。"], None
     purchase_details_list = []
+    planned_item_keys = []
     supplier_totals = {name: 0.0 for name in current_supplier_display_names if name in all_prices_df['供应商'].unique()}
     not_found_in_any_supplier = []
     for internal_key, need_details in procurement_needs_internal.items():
@@ -164,13 +362,17 @@ def generate_purchase_plan(supplier_dataframes_dict, procurement_needs_internal,
         min_price = best_offer_series['价格']
         chosen_supplier = best_offer_series['供应商']
         sub_total = min_price * quantity_needed
+        # 比价详情 / 报价数 / 价差均按每家供应商的最低价计算，与选价逻辑及 build_top_offers 一致
+        lowest_by_supplier = product_offers_for_this_item.groupby('供应商')['价格'].min()
         price_comparison_details = {}
         for sup_name in current_supplier_display_names:
-            offer_from_sup = product_offers_for_this_item[product_offers_for_this_item['供应商'] == sup_name]
-            if not offer_from_sup.empty:
-                price_comparison_details[sup_name] = offer_from_sup['价格'].iloc[0]
+            if sup_name in lowest_by_supplier.index:
+                price_comparison_details[sup_name] = float(lowest_by_supplier[sup_name])
             else:
                 price_comparison_details[sup_name] = "未报价"
+        quoted_prices = lowest_by_supplier[lowest_by_supplier.index.isin(current_supplier_display_names)]
+        price_spread_pct = (quoted_prices.max() - quoted_prices.min()) / quoted_prices.min() * 100 if len(quoted_prices) else 0.0
+        planned_item_keys.append(internal_key)
         purchase_details_list.append({
             '产品显示名称': display_name_for_output,
             '品名': product_name_needed,
@@ -179,7 +381,9 @@ def generate_purchase_plan(supplier_dataframes_dict, procurement_needs_internal,
             '选择的供应商': chosen_supplier,
             '单价': min_price,
             '金额': sub_total,
-            '比价详情': price_comparison_details
+            '比价详情': price_comparison_details,
+            '报价数': len(quoted_prices),  # 供搜索面板的 "仅单一报价" / "价差" 过滤直接使用
+            '价差%': price_spread_pct
         })
         if chosen_supplier in supplier_totals:
             supplier_totals[chosen_supplier] += sub_total
@@ -188,7 +392,150 @@ def generate_purchase_plan(supplier_dataframes_dict, procurement_needs_internal,
     if not_found_in_any_supplier:
         notes.append(f"以下产品在所有供应商报价中均未找到: {', '.join(not_found_in_any_supplier)}.")
     supplier_totals = {k: v for k, v in supplier_totals.items() if v > 0 or (not purchase_df.empty and k in purchase_df['选择的供应商'].unique())}
-    return purchase_df, supplier_totals, notes
+    quantities = purchase_df['采购数量'].to_numpy(dtype=float) if not purchase_df.empty else np.empty(0)
+    top_offers = build_top_offers(all_prices_df, planned_item_keys, quantities, current_supplier_display_names)
+    return purchase_df, supplier_totals, notes, top_offers
+
+
+def build_top_offers(all_prices_df, item_keys, quantities, supplier_names, k=None):
+    """
+    为采购单中的每个商品按价格从低到高保留前 k 个报价 (按行与 purchase_df 对齐)，
+    供 apply_what_if 在排除供应商或调价时直接重算，无需重新比价。
+    k 默认为供应商数 (最多 MAX_SUPPLIERS 家)，即保留全部报价：调价可能让排名靠后的供应商
+    变成最低价，只保留部分报价时这类结果会算错。
+    """
+    supplier_count = len(supplier_names)
+    wanted_keys = [key.strip().lower() for key in item_keys]
+    offers = pd.DataFrame({
+        'key': all_prices_df['产品标识符'].astype(str).str.strip().str.lower(),
+        # 不用 Categorical：名称重复时它会报错，这里重复名称取第一次出现的序号
+        'sup': all_prices_df['供应商'].map({name: i for i, name in reversed(list(enumerate(supplier_names)))}).fillna(-1).astype(np.int64).to_numpy(),
+        'price': all_prices_df['价格'].to_numpy(dtype=float),
+    })
+    offers = offers[offers['key'].isin(wanted_keys) & (offers['sup'] >= 0)]
+    # 同一供应商对同一商品有多条报价时取最低价，与 generate_purchase_plan 的选择一致
+    matrix = (offers.groupby(['key', 'sup'])['price'].min()
+              .unstack('sup')
+              .reindex(index=wanted_keys, columns=range(supplier_count))
+              .to_numpy(dtype=float))
+    matrix = np.where(np.isnan(matrix), np.inf, matrix)
+
+    k = supplier_count if k is None else max(1, min(k, supplier_count))
+    top_sup = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+    top_prices = np.take_along_axis(matrix, top_sup, axis=1)
+    # 只对前 k 列排序；同价时按供应商顺序，和 idxmin 取第一个的行为一致
+    order = np.lexsort((top_sup, top_prices), axis=1)
+    top_sup = np.take_along_axis(top_sup, order, axis=1)
+    top_prices = np.take_along_axis(top_prices, order, axis=1)
+    top_sup = np.where(np.isfinite(top_prices), top_sup, -1)
+    quantities = np.asarray(quantities, dtype=float)
+
+    return {
+        'supplier_names': list(supplier_names),
+        'prices': top_prices,
+        'suppliers': top_sup,
+        'quantities': quantities,
+        'base_total': float(np.sum(top_prices[:, 0] * quantities)),
+    }
+
+
+def apply_what_if(top_offers, excluded_suppliers=(), price_factors=None):
+    """
+    在 build_top_offers 的结果上模拟排除供应商 / 按系数调整报价，返回新的采购方案：
+    chosen (每个商品选中的供应商序号，-1 表示所有报价均被排除)、unit_prices、amounts、
+    supplier_totals、grand_total 以及相对原方案的 delta。
+    """
+    supplier_names = top_offers['supplier_names']
+    factors = np.ones(len(supplier_names))
+    for name, factor in (price_factors or {}).items():
+        if name in supplier_names:
+            factors[supplier_names.index(name)] = factor
+    available = np.array([name not in excluded_suppliers for name in supplier_names], dtype=bool)
+
+    top_sup = top_offers['suppliers']
+    valid = top_sup >= 0
+    safe_sup = np.where(valid, top_sup, 0)
+    adjusted = np.where(valid & available[safe_sup], top_offers['prices'] * factors[safe_sup], np.inf)
+
+    rows = np.arange(adjusted.shape[0])
+    best_pos = adjusted.argmin(axis=1)
+    unit_prices = adjusted[rows, best_pos]
+    found = np.isfinite(unit_prices)
+    chosen = np.where(found, safe_sup[rows, best_pos], -1)
+    unit_prices = np.where(found, unit_prices, np.nan)
+    amounts = np.where(found, unit_prices * top_offers['quantities'], 0.0)
+
+    totals = np.bincount(chosen[found], weights=amounts[found], minlength=len(supplier_names))
+    chosen_set = set(chosen[found].tolist())
+    supplier_totals = {name: float(totals[i]) for i, name in enumerate(supplier_names) if i in chosen_set}
+    grand_total = float(amounts.sum())
+    return {
+        'chosen': chosen,
+        'unit_prices': unit_prices,
+        'amounts': amounts,
+        'supplier_totals': supplier_totals,
+        'grand_total': grand_total,
+        'delta': grand_total - top_offers['base_total'],
+        'factors': factors,
+        'available': available,
+    }
+
+
+def build_search_index(purchase_df, supplier_names):
+    """
+    为采购单建立单字 + 双字 (bigram) 倒排索引，检索字段为 产品显示名称 / 规格。
+    供应商不进索引：行所属供应商会随假设分析变化，检索时按行当前所在分组匹配供应商名称。
+    每次比价只建一次，之后每次输入只做集合求交，不再扫描整张表。
+    """
+    row_fields = []
+    postings = {}
+    for pos, (display_name, spec) in enumerate(zip(purchase_df['产品显示名称'], purchase_df['规格'])):
+        fields = [str(display_name).lower(), str(spec).lower()]
+        row_fields.append("\n".join(fields))
+        for field in fields:
+            for i in range(len(field)):
+                postings.setdefault(field[i], set()).add(pos)
+                if i + 1 < len(field):
+                    postings.setdefault(field[i:i + 2], set()).add(pos)
+    return {
+        'row_fields': row_fields,
+        'supplier_names': [str(name).lower() for name in supplier_names],
+        'postings': {gram: np.fromiter(sorted(rows), dtype=np.int64, count=len(rows)) for gram, rows in postings.items()},
+        'quote_counts': purchase_df['报价数'].to_numpy(dtype=np.int64),
+        'price_spreads': purchase_df['价差%'].to_numpy(dtype=float),
+    }
+
+
+def search_purchase_rows(search_index, query, row_groups, only_single_quote=False, min_spread_pct=None):
+    """
+    返回与采购单行对齐的布尔掩码；query 按空白拆成多个词，需全部命中。
+    每个词命中品名/规格，或命中该行当前所在分组 (row_groups，对应 supplier_names 的序号) 的供应商名称即可。
+    """
+    row_count = len(search_index['row_fields'])
+    mask = np.ones(row_count, dtype=bool)
+    empty = np.empty(0, dtype=np.int64)
+    for term in query.lower().split():
+        grams = [term] if len(term) == 1 else [term[i:i + 2] for i in range(len(term) - 1)]
+        posting_lists = sorted((search_index['postings'].get(gram, empty) for gram in grams), key=len)
+        candidates = posting_lists[0]
+        for posting in posting_lists[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        if len(term) > 2:
+            # bigram 命中不保证连续出现，只对候选行做一次子串确认
+            candidates = [pos for pos in candidates if term in search_index['row_fields'][pos]]
+        term_mask = np.zeros(row_count, dtype=bool)
+        term_mask[candidates] = True
+        matched_groups = [group for group, name in enumerate(search_index['supplier_names']) if term in name]
+        if matched_groups:
+            term_mask |= np.isin(row_groups, matched_groups)
+        mask &= term_mask
+    if only_single_quote:
+        mask &= search_index['quote_counts'] == 1
+    if min_spread_pct is not None:
+        mask &= search_index['price_spreads'] > min_spread_pct
+    return mask
 
 
 class ProcurementApp:
@@ -209,12 +556,24 @@ class ProcurementApp:
 
         self.supplier_entries = []
         self.supplier_frame_widgets = {}
+        self.column_mapping_cache = {}  # 文件绝对路径 -> {'fingerprint': 文件指纹, 'mapping': 自动识别的表头映射}
 
         # 用于导出Excel时获取上次运行的汇总数据
         self.last_run_supplier_totals_dict = {}
         self.last_run_notes_list = []
         self.last_run_grand_total_cost = 0.0
 
+        # 假设分析 (what-if) 用的数据与 Treeview 节点
+        self.top_offers = None
+        self.what_if_vars = {}
+        self.what_if_plan = None  # 假设分析生效时的 (采购明细, 总额, 备注)，导出时优先使用
+        self.what_if_rows = []  # 与 current_purchase_df 行对齐: (采购数量, 比价详情)
+        self.purchase_row_iids = []
+        self.group_iids = []  # 每个供应商一个分组节点，最后一个为 "无可用报价" 分组
+        self.row_groups = np.empty(0, dtype=np.int64)  # 每行当前所属分组
+        self.row_visible = np.empty(0, dtype=bool)  # 每行是否通过搜索/过滤
+        self.search_index = None
+
         main_frame = ttk.Frame(root, padding="10")
         main_frame.pack(expand=True, fill=tk.BOTH)
 
@@ -269,6 +628,25 @@ class ProcurementApp:
         results_frame.pack(expand=True, fill=tk.BOTH, pady=5)
         ttk.Label(results_frame, text="采购详情 (按供应商):", font="-weight bold").pack(anchor=tk.W)
 
+        self.what_if_frame = ttk.LabelFrame(results_frame, text="假设分析: 排除供应商 / 调整报价 (无需重新比价)", padding="5")
+        self.what_if_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+        self.what_if_summary_var = tk.StringVar(value="完成比价后可在此模拟供应商缺货或调价。")
+
+        search_frame = ttk.Frame(results_frame)
+        search_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+        ttk.Label(search_frame, text="搜索 (品名/规格/供应商):").pack(side=tk.LEFT, padx=(0, 5))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add('write', lambda *args: self._apply_search_filter())
+        ttk.Entry(search_frame, textvariable=self.search_var, width=30).pack(side=tk.LEFT, padx=(0, 10))
+        self.single_quote_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_frame, text="仅单一报价", variable=self.single_quote_only_var, command=self._apply_search_filter).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Label(search_frame, text="价差大于(%):").pack(side=tk.LEFT)
+        self.min_spread_var = tk.StringVar()
+        self.min_spread_var.trace_add('write', lambda *args: self._apply_search_filter())
+        ttk.Spinbox(search_frame, from_=0, to=1000, increment=5, width=6, textvariable=self.min_spread_var).pack(side=tk.LEFT, padx=(2, 10))
+        self.search_status_var = tk.StringVar()
+        ttk.Label(search_frame, textvariable=self.search_status_var, foreground="gray").pack(side=tk.LEFT)
+
         self.purchase_table_container = ttk.Frame(results_frame)
         self.purchase_table_container.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         self.purchase_table = None
@@ -279,6 +657,7 @@ class ProcurementApp:
         style.configure("Accent.TButton", foreground="white", background="green", font=("-weight bold"))
 
         self._load_cached_procurement_list()
+        self._build_what_if_panel([])  # 显示假设分析面板的初始提示
 
         # --- 修改点：设置窗口关闭时的回调 ---
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -306,6 +685,9 @@ class ProcurementApp:
             if os.path.exists(cache_path):
                 with open(cache_path, 'r', encoding='utf-8') as f:
                     cached_data = json.load(f)
+                    # 只保留按路径记录的条目，旧版按指纹作键的条目直接丢弃
+                    self.column_mapping_cache = {path: entry for path, entry in cached_data.get("column_mappings", {}).items()
+                                                 if isinstance(entry, dict) and 'fingerprint' in entry}
                     procurement_text = cached_data.get("procurement_list", "")
                     if procurement_text: # 确保不是空字符串再覆盖
                         self.procurement_needs_text.delete("1.0", tk.END)
@@ -341,6 +723,7 @@ class ProcurementApp:
             data_to_save = {"procurement_list": ""}  # 存空，下次加载时会用默认示例
         else:
             data_to_save = {"procurement_list": procurement_text}
+        data_to_save["column_mappings"] = self.column_mapping_cache
 
         try:
             with open(cache_path, 'w', encoding='utf-8') as f:
@@ -365,6 +748,7 @@ class ProcurementApp:
         self.procurement_needs_text.insert(tk.END, "例如:\n土豆,70cm,100\n苹果,大,50\n香蕉,小,20\n白菜,,30 (如无规格则第二项留空)")
 
         # 删除缓存文件
+        self.column_mapping_cache = {}
         cache_path = self._get_cache_file_path()
         try:
             if os.path.exists(cache_path):
@@ -404,11 +788,19 @@ class ProcurementApp:
         file_entry.grid(row=0, column=3, padx=(0, 5), pady=2, sticky=tk.EW)
         browse_button = ttk.Button(row_frame, text="选择文件", command=lambda idx=row_index: self.browse_file_for_supplier(idx))
         browse_button.grid(row=0, column=4, pady=2, sticky=tk.W)
+        mapping_var = tk.StringVar()
+        mapping_label = ttk.Label(row_frame, textvariable=mapping_var, foreground="gray")
+        mapping_label.grid(row=1, column=1, columnspan=3, padx=(0, 5), sticky=tk.W)
+        mapping_toggle_button = ttk.Button(row_frame, text="取消识别", state=tk.DISABLED if not file_path else tk.NORMAL,
+                                            command=lambda idx=row_index: self.toggle_supplier_column_mapping(idx))
+        mapping_toggle_button.grid(row=1, column=4, pady=(0, 2), sticky=tk.W)
         row_frame.grid_columnconfigure(3, weight=1)
         self.supplier_entries.append({
             'name_label': name_label, 'name_var': name_var, 'name_entry': name_entry,
             'file_label': file_label, 'file_entry': file_entry,
             'browse_button': browse_button, 'path_var': path_var,
+            'mapping_var': mapping_var, 'mapping_label': mapping_label, 'column_mapping': None,
+            'mapping_toggle_button': mapping_toggle_button, 'mapping_disabled': False,
             'row_frame': row_frame
         })
         self._update_add_remove_buttons_state()
@@ -440,6 +832,83 @@ class ProcurementApp:
             potential_name = potential_name.replace("报价单", "").replace("报价", "").replace("价格表", "").strip()
             if not potential_name: potential_name = f"供应商 {chr(ord('A') + supplier_index)}"
             name_var.set(potential_name)
+            self.supplier_entries[supplier_index]['mapping_disabled'] = False  # 新文件重新启用自动识别
+            self._update_supplier_column_mapping(supplier_index)
+
+    def toggle_supplier_column_mapping(self, supplier_index):
+        """取消/恢复某个供应商的表头自动识别；取消后按填写的列名读取第一个工作表的首行表头"""
+        s_entry = self.supplier_entries[supplier_index]
+        s_entry['mapping_disabled'] = not s_entry['mapping_disabled']
+        self._update_supplier_column_mapping(supplier_index)
+
+    def _get_column_mapping_for_file(self, file_path, typed_columns):
+        """
+        按路径取回已记忆的列映射，文件指纹和填写的列名都不变时直接使用，否则只读表头区域重新识别。
+        每个文件只保留一条记录，文件修改后旧记录被覆盖。
+        """
+        cache_key = os.path.abspath(file_path)
+        try:
+            fingerprint = file_fingerprint(file_path)
+        except OSError as e:
+            print(f"计算文件指纹失败: {e}")
+            return None
+        cached_entry = self.column_mapping_cache.get(cache_key)
+        if cached_entry and cached_entry['fingerprint'] == fingerprint and cached_entry.get('typed_columns') == typed_columns:
+            return cached_entry['mapping']
+        try:
+            mapping = sniff_header(file_path, typed_columns)
+        except Exception as e:
+            print(f"识别表头失败: {e}")
+            return None
+        if mapping:
+            self.column_mapping_cache[cache_key] = {'fingerprint': fingerprint, 'typed_columns': typed_columns, 'mapping': mapping}
+        else:
+            self.column_mapping_cache.pop(cache_key, None)
+        return mapping
+
+    def _update_supplier_column_mapping(self, supplier_index):
+        s_entry = self.supplier_entries[supplier_index]
+        file_path = s_entry['path_var'].get()
+        s_entry['mapping_toggle_button'].config(text="恢复识别" if s_entry['mapping_disabled'] else "取消识别",
+                                                state=tk.NORMAL if file_path else tk.DISABLED)
+        if s_entry['mapping_disabled']:
+            s_entry['column_mapping'] = None
+            s_entry['mapping_var'].set("已取消自动识别，将按下方填写的列名读取第一个工作表" if file_path else "")
+            return
+        typed_columns = {'品名': self.product_name_col_var.get().strip(), '规格': self.spec_col_var.get().strip(),
+                         '价格': self.price_col_var.get().strip()}
+        mapping = self._get_column_mapping_for_file(file_path, typed_columns) if file_path else None
+        s_entry['column_mapping'] = mapping
+        if mapping:
+            cols_text = ", ".join(f"{field}={header}" for field, header in mapping['columns'].items())
+            source_text = "按填写的列名定位" if mapping.get('typed_match') else "自动识别"
+            s_entry['mapping_var'].set(f"{source_text}: 工作表 '{mapping['sheet']}' 第 {mapping['header_row'] + 1} 行 | {cols_text}")
+        elif file_path:
+            s_entry['mapping_var'].set("未识别到表头，将使用下方填写的列名")
+        else:
+            s_entry['mapping_var'].set("")
+
+    def _resolve_supplier_columns(self, s_entry, product_name_col, spec_col, price_col):
+        """
+        合并用户填写的列名与自动识别结果：填写的列名存在于识别到的表头中时优先使用，
+        否则采用识别出的列；规格列留空表示不使用规格，不做替换；
+        识别到的表头中既没有填写的规格列也没有识别出规格列时，按无规格处理。
+        """
+        mapping = s_entry.get('column_mapping')
+        if not mapping:
+            return {'product_name_col': product_name_col, 'spec_col_name': spec_col if spec_col else None, 'price_col': price_col}
+        header_values = mapping['header_values']
+        proposed = mapping['columns']
+        resolved_spec = None
+        if spec_col:
+            resolved_spec = spec_col if spec_col in header_values else proposed.get('规格')
+        return {
+            'product_name_col': product_name_col if product_name_col in header_values else proposed['品名'],
+            'spec_col_name': resolved_spec,
+            'price_col': price_col if price_col in header_values else proposed['价格'],
+            'sheet_name': mapping['sheet'],
+            'header_row': mapping['header_row'],
+        }
 
     def _setup_purchase_table(self, supplier_display_names_for_cols):
         # (基本不变, 包含比价参考列)
@@ -486,6 +955,10 @@ class ProcurementApp:
 
         self.export_button.config(state=tk.DISABLED)
         self.current_purchase_df = pd.DataFrame()  # 清空数据
+        self.top_offers = None
+        self.search_index = None
+        self.search_status_var.set("")
+        self._build_what_if_panel([])
 
     def clear_inputs(self):
         for _ in range(len(self.supplier_entries) - self.INITIAL_SUPPLIERS):
@@ -495,6 +968,8 @@ class ProcurementApp:
                 for _ in range(self.INITIAL_SUPPLIERS - len(self.supplier_entries)): self._add_supplier_row_ui()
         for i in range(min(len(self.supplier_entries), self.INITIAL_SUPPLIERS)):
             self.supplier_entries[i]['path_var'].set("")
+            self.supplier_entries[i]['mapping_disabled'] = False
+            self._update_supplier_column_mapping(i)
             self.supplier_entries[i]['name_var'].set(f"供应商 {chr(ord('A') + i)}")
 
         self.product_name_col_var.set(self.DEFAULT_PRODUCT_NAME_COL)
@@ -526,13 +1001,27 @@ class ProcurementApp:
                 display_name = f"供应商 {chr(ord('A') + i)}"
                 s_entry['name_var'].set(display_name)
             if file_path:
-                active_suppliers_info.append({'path': file_path, 'name': display_name})
+                self._update_supplier_column_mapping(i)  # 文件可能已被修改，按当前指纹重新取映射
+                active_suppliers_info.append({'path': file_path, 'name': display_name, 'entry': s_entry})
         if not active_suppliers_info or len(active_suppliers_info) < self.MIN_SUPPLIERS:
             messagebox.showerror('输入错误', f'请至少为 {self.MIN_SUPPLIERS} 个供应商选择报价文件并确保它们有名称！')
             return
+        supplier_names_seen = set()
+        duplicate_names = []
+        for s_info in active_suppliers_info:
+            if s_info['name'] in supplier_names_seen and s_info['name'] not in duplicate_names:
+                duplicate_names.append(s_info['name'])
+            supplier_names_seen.add(s_info['name'])
+        if duplicate_names:
+            messagebox.showerror('输入错误', f"供应商名称重复: {', '.join(duplicate_names)}\n请为每个供应商填写不同的名称！")
+            return
 
         current_supplier_display_names_for_cols = [s_info['name'] for s_info in active_suppliers_info]
         self._setup_purchase_table(current_supplier_display_names_for_cols)
+        self.top_offers = None  # 旧表格节点已销毁，假设分析和搜索索引需等本次比价完成后重建
+        self.search_index = None
+        self.search_status_var.set("")
+        self._build_what_if_panel([])
 
         procurement_text_input = self.procurement_needs_text.get("1.0", tk.END)
         product_name_col = self.product_name_col_var.get().strip()
@@ -551,17 +1040,24 @@ class ProcurementApp:
 
         loaded_dfs_dict = {}
         for s_info in active_suppliers_info:
-            # 传递 spec_col (可能是空字符串) 给 load_and_prepare_data
-            df = load_and_prepare_data(s_info['path'], s_info['name'], product_name_col, spec_col if spec_col else None, price_col)
+            # 按自动识别的表头位置读取；未识别时沿用填写的列名 (spec_col 为空表示不使用规格)
+            column_kwargs = self._resolve_supplier_columns(s_info['entry'], product_name_col, spec_col, price_col)
+            df = load_and_prepare_data(s_info['path'], s_info['name'], **column_kwargs)
             if df is None: return
             loaded_dfs_dict[s_info['name']] = df
 
-        purchase_df, supplier_totals_dict, notes_list = generate_purchase_plan(
+        price_rejection_notes = self._summarize_price_rejections(loaded_dfs_dict)
+        if price_rejection_notes:
+            messagebox.showwarning("价格数据警告", "以下报价行的价格无法识别，已跳过:\n" + "\n".join(price_rejection_notes))
+
+        purchase_df, supplier_totals_dict, notes_list, top_offers = generate_purchase_plan(
             loaded_dfs_dict,
             procurement_needs_internal,
             current_supplier_display_names_for_cols
         )
         self.current_purchase_df = purchase_df
+        self.top_offers = top_offers
+        notes_list = notes_list + price_rejection_notes
 
         # 保存本次运行的汇总数据，以便导出Excel时使用
         self.last_run_supplier_totals_dict = supplier_totals_dict
@@ -571,6 +1067,12 @@ class ProcurementApp:
         if self.purchase_table:
             for item in self.purchase_table.get_children(): self.purchase_table.delete(item)
 
+        self.group_iids = [None] * (len(current_supplier_display_names_for_cols) + 1)
+        self.purchase_row_iids = [None] * len(purchase_df)
+        self.row_groups = np.full(len(purchase_df), -1, dtype=np.int64)
+        self.row_visible = np.ones(len(purchase_df), dtype=bool)
+        self.what_if_rows = list(zip(purchase_df['采购数量'], purchase_df['比价详情'])) if not purchase_df.empty else []
+
         grand_total_cost = 0.0  # 重置grand_total_cost
         if not purchase_df.empty:
             for chosen_sup_name in current_supplier_display_names_for_cols:
@@ -581,21 +1083,16 @@ class ProcurementApp:
                     parent_iid = self.purchase_table.insert("", tk.END,
                                                             text=f"{chosen_sup_name} (总计: {total_for_supplier:.2f} 元)",
                                                             open=True, tags=('supplier_header',))
+                    group = current_supplier_display_names_for_cols.index(chosen_sup_name)
+                    self.group_iids[group] = parent_iid
                     for index, row in group_df.iterrows():
                         product_display_name_from_df = row['产品显示名称']
-                        qty = row['采购数量']
-                        unit_price_selected = row['单价']
-                        item_total = row['金额']
-                        fixed_values = (qty, f"{unit_price_selected:.2f}", f"{item_total:.2f}")
-                        separator_value = ("---->",)
-                        comparison_values = []
-                        comparison_details_dict = row['比价详情']
-                        for sup_compare_name in current_supplier_display_names_for_cols:
-                            price = comparison_details_dict.get(sup_compare_name, "未报价")
-                            formatted_price = f"{price:.2f}" if isinstance(price, (int, float)) else str(price)
-                            comparison_values.append(formatted_price)
-                        child_values = fixed_values + separator_value + tuple(comparison_values)
-                        self.purchase_table.insert(parent_iid, tk.END, text=f"  └ {product_display_name_from_df}", values=child_values)
+                        child_values = self._format_purchase_row_values(
+                            row['采购数量'], row['单价'], row['金额'], row['比价详情'], current_supplier_display_names_for_cols)
+                        row_pos = purchase_df.index.get_loc(index)
+                        self.purchase_row_iids[row_pos] = self.purchase_table.insert(
+                            parent_iid, tk.END, text=f"  └ {product_display_name_from_df}", values=child_values)
+                        self.row_groups[row_pos] = group
             self.export_button.config(state=tk.NORMAL)
         else:
             if not notes_list or all("没有加载到任何有效的供应商报价数据。" in note for note in notes_list) or all("所有供应商的报价数据均为空或无效。" in note for note in notes_list):
@@ -604,6 +1101,9 @@ class ProcurementApp:
             self.export_button.config(state=tk.DISABLED)
 
         self.last_run_grand_total_cost = grand_total_cost  # 保存计算出的总额
+        self._build_what_if_panel(current_supplier_display_names_for_cols if not purchase_df.empty else [])
+        self.search_index = build_search_index(purchase_df, current_supplier_display_names_for_cols) if not purchase_df.empty else None
+        self._apply_search_filter()  # 保留搜索框中已有的条件
 
         # 移除对已删除UI控件的更新
         # self.total_procurement_cost_var.set(f"总采购额: {grand_total_cost:.2f} 元")
@@ -612,10 +1112,213 @@ class ProcurementApp:
         # self.notes_text.config(state=tk.NORMAL); self.notes_text.delete("1.0", tk.END)
         # ...
 
+    @staticmethod
+    def _summarize_price_rejections(loaded_dfs_dict, max_examples=3):
+        """把各供应商被拒绝的价格行汇总成备注文字，每家列出前几条示例"""
+        notes = []
+        for supplier_name, df in loaded_dfs_dict.items():
+            rejected_rows = df.attrs.get('价格拒绝行', [])
+            if not rejected_rows:
+                continue
+            examples = "; ".join(f"第 {row_no} 行 '{raw}' ({reason})" for row_no, raw, reason in rejected_rows[:max_examples])
+            more = " 等" if len(rejected_rows) > max_examples else ""
+            notes.append(f"{supplier_name}: {len(rejected_rows)} 行价格被跳过，如 {examples}{more}.")
+        return notes
+
+    @staticmethod
+    def _format_purchase_row_values(qty, unit_price, amount, comparison_details_dict, supplier_names, factors=None, excluded=()):
+        """生成采购明细行的 Treeview values；factors/excluded 用于假设分析下的比价列"""
+        if pd.isna(unit_price):
+            fixed_values = (qty, "-", "-")
+        else:
+            fixed_values = (qty, f"{unit_price:.2f}", f"{amount:.2f}")
+        comparison_values = []
+        for sup_compare_name in supplier_names:
+            price = comparison_details_dict.get(sup_compare_name, "未报价")
+            if sup_compare_name in excluded:
+                comparison_values.append("已排除")
+            elif isinstance(price, (int, float)):
+                factor = factors.get(sup_compare_name, 1.0) if factors else 1.0
+                comparison_values.append(f"{price * factor:.2f}")
+            else:
+                comparison_values.append(str(price))
+        return fixed_values + ("---->",) + tuple(comparison_values)
+
+    def _build_what_if_panel(self, supplier_names):
+        for widget in self.what_if_frame.winfo_children(): widget.destroy()
+        self.what_if_vars = {}
+        self.what_if_plan = None
+        if not supplier_names or self.top_offers is None:
+            self.what_if_summary_var.set("完成比价后可在此模拟供应商缺货或调价。")
+            ttk.Label(self.what_if_frame, textvariable=self.what_if_summary_var).grid(row=0, column=0, sticky=tk.W)
+            return
+        for i, name in enumerate(supplier_names):
+            include_var = tk.BooleanVar(value=True)
+            pct_var = tk.StringVar(value="0")
+            ttk.Checkbutton(self.what_if_frame, text=name, variable=include_var, command=self._apply_what_if).grid(row=0, column=i * 2, padx=(5, 2), sticky=tk.W)
+            pct_spinbox = ttk.Spinbox(self.what_if_frame, from_=-90, to=100, increment=1, width=5, textvariable=pct_var, command=self._apply_what_if)
+            pct_spinbox.grid(row=0, column=i * 2 + 1, padx=(0, 10), sticky=tk.W)
+            pct_spinbox.bind('<Return>', lambda e: self._apply_what_if())
+            pct_spinbox.bind('<FocusOut>', lambda e: self._apply_what_if())
+            self.what_if_vars[name] = (include_var, pct_var)
+        ttk.Button(self.what_if_frame, text="恢复原方案", command=self.reset_what_if).grid(row=0, column=len(supplier_names) * 2, padx=5)
+        ttk.Label(self.what_if_frame, text="(勾选 = 参与比价，数值 = 调价百分比，如 -5 表示降价 5%)", foreground="gray").grid(row=1, column=0, columnspan=len(supplier_names) * 2 + 1, sticky=tk.W)
+        ttk.Label(self.what_if_frame, textvariable=self.what_if_summary_var).grid(row=2, column=0, columnspan=len(supplier_names) * 2 + 1, sticky=tk.W)
+        self.what_if_summary_var.set(f"原方案总额: {self.top_offers['base_total']:.2f} 元")
+
+    def reset_what_if(self):
+        for include_var, pct_var in self.what_if_vars.values():
+            include_var.set(True)
+            pct_var.set("0")
+        self._apply_what_if()
+
+    def _get_or_create_group_iid(self, group):
+        if self.group_iids[group] is None:
+            self.group_iids[group] = self.purchase_table.insert("", tk.END, open=True, tags=('supplier_header',))
+        return self.group_iids[group]
+
+    def _refresh_tree_rows(self, rows=None):
+        """
+        按 row_groups / row_visible 把明细行挂到对应分组下或摘下 (detach)，不删除重建节点。
+        rows 为需要调整的行号 (升序)，默认全部；分组节点在没有可见行时一并摘下。
+        """
+        if rows is None:
+            rows = np.arange(len(self.purchase_row_iids))
+        hidden_iids = [self.purchase_row_iids[pos] for pos in rows if not self.row_visible[pos]]
+        if hidden_iids:
+            self.purchase_table.detach(*hidden_iids)
+        # 组内排在它前面的可见行数即为插入位置；行号升序处理保证前面的行已就位
+        rank_in_group = np.zeros(len(self.row_groups), dtype=np.int64)
+        for group in np.unique(self.row_groups):
+            in_group = (self.row_groups == group) & self.row_visible
+            rank_in_group[in_group] = np.arange(in_group.sum())
+        for pos in rows:
+            if self.row_visible[pos]:
+                group_iid = self._get_or_create_group_iid(self.row_groups[pos])
+                self.purchase_table.move(self.purchase_row_iids[pos], group_iid, int(rank_in_group[pos]))
+        position = 0
+        for group, group_iid in enumerate(self.group_iids):
+            if group_iid is None:
+                continue
+            if (self.row_visible & (self.row_groups == group)).any():
+                self.purchase_table.move(group_iid, "", position)
+                position += 1
+            else:
+                self.purchase_table.detach(group_iid)
+
+    def _apply_what_if(self):
+        """按面板上的排除/调价设置重算采购方案，并原地移动、更新 Treeview 中的条目"""
+        if self.top_offers is None or not self.purchase_table or not self.what_if_vars:
+            return
+        excluded = {name for name, (include_var, _) in self.what_if_vars.items() if not include_var.get()}
+        factors = {}
+        invalid_inputs = []
+        for name, (_, pct_var) in self.what_if_vars.items():
+            try:
+                factor = 1 + float(pct_var.get().strip() or 0) / 100
+            except ValueError:
+                factor = None
+            if factor is None or factor <= 0:
+                invalid_inputs.append(name)
+                continue
+            factors[name] = factor
+
+        result = apply_what_if(self.top_offers, excluded, factors)
+        supplier_names = self.top_offers['supplier_names']
+        chosen = result['chosen']
+
+        for row_pos, iid in enumerate(self.purchase_row_iids):
+            qty, comparison_details_dict = self.what_if_rows[row_pos]
+            values = self._format_purchase_row_values(qty, result['unit_prices'][row_pos], result['amounts'][row_pos],
+                                                      comparison_details_dict, supplier_names, factors, excluded)
+            self.purchase_table.item(iid, values=values)
+        # 所有报价均被排除的行归入最后一个 "无可用报价" 分组
+        self.row_groups = np.where(chosen >= 0, chosen, len(supplier_names))
+
+        for name, total in result['supplier_totals'].items():
+            group_iid = self._get_or_create_group_iid(supplier_names.index(name))
+            self.purchase_table.item(group_iid, text=f"{name} (总计: {total:.2f} 元)")
+        unresolved_count = int((chosen < 0).sum())
+        if unresolved_count:
+            self.purchase_table.item(self._get_or_create_group_iid(len(supplier_names)),
+                                     text=f"无可用报价 (报价供应商均已排除，共 {unresolved_count} 项)")
+        # 供应商检索按行当前分组匹配，分组变化后需重新过滤
+        self._apply_search_filter(refresh_all=True)
+
+        summary = (f"模拟总额: {result['grand_total']:.2f} 元 | 原方案: {self.top_offers['base_total']:.2f} 元 | "
+                   f"差额: {result['delta']:+.2f} 元")
+        if unresolved_count:
+            summary += f" | {unresolved_count} 项无可用报价，未计入总额"
+        if invalid_inputs:
+            summary += f" | 调价输入无效已忽略: {', '.join(invalid_inputs)}"
+        scenario_active = bool(excluded) or any(factor != 1 for factor in factors.values())
+        self.what_if_plan = self._build_what_if_plan(result, factors, excluded) if scenario_active else None
+        if scenario_active:
+            summary += " | 导出将使用当前模拟方案"
+        self.what_if_summary_var.set(summary)
+
+    def _build_what_if_plan(self, result, factors, excluded):
+        """把假设分析结果整理成与 current_purchase_df 同结构的采购明细，供导出使用"""
+        supplier_names = self.top_offers['supplier_names']
+        chosen = result['chosen']
+        plan_df = self.current_purchase_df.copy()
+        plan_df['选择的供应商'] = [supplier_names[c] if c >= 0 else "" for c in chosen]
+        plan_df['单价'] = result['unit_prices']
+        plan_df['金额'] = result['amounts']
+        plan_df['比价详情'] = [
+            {name: ("已排除" if name in excluded else price * factors.get(name, 1.0) if isinstance(price, (int, float)) else price)
+             for name, price in details.items()}
+            for details in plan_df['比价详情']]
+        unresolved_names = plan_df.loc[chosen < 0, '产品显示名称'].tolist()
+        plan_df = plan_df[chosen >= 0]
+
+        scenario_parts = []
+        if excluded:
+            scenario_parts.append(f"排除供应商 {', '.join(name for name in supplier_names if name in excluded)}")
+        adjusted = [f"{name} {(factor - 1) * 100:+g}%" for name, factor in factors.items() if factor != 1]
+        if adjusted:
+            scenario_parts.append(f"调价 {', '.join(adjusted)}")
+        notes = [f"假设分析方案: {'; '.join(scenario_parts)} (原方案总额 {self.top_offers['base_total']:.2f} 元，差额 {result['delta']:+.2f} 元)."]
+        if unresolved_names:
+            notes.append(f"以下产品的报价供应商均已排除，未计入采购单: {', '.join(unresolved_names)}.")
+        return plan_df, result['grand_total'], notes + self.last_run_notes_list
+
+    def _apply_search_filter(self, refresh_all=False):
+        """
+        每次输入只查倒排索引并对可见性发生变化的行做 detach/重新挂载；
+        refresh_all 用于假设分析改变了行的分组后，重新放置全部行。
+        """
+        if self.search_index is None or not self.purchase_table:
+            if refresh_all:
+                self._refresh_tree_rows()
+            return
+        min_spread_text = self.min_spread_var.get().strip()
+        try:
+            min_spread_pct = float(min_spread_text) if min_spread_text else None
+        except ValueError:
+            min_spread_pct = None
+        mask = search_purchase_rows(self.search_index, self.search_var.get(), self.row_groups,
+                                    only_single_quote=self.single_quote_only_var.get(), min_spread_pct=min_spread_pct)
+        changed_rows = np.flatnonzero(mask != self.row_visible)
+        self.row_visible = mask
+        if refresh_all:
+            self._refresh_tree_rows()
+        elif len(changed_rows):
+            self._refresh_tree_rows(changed_rows)
+        status = f"显示 {int(mask.sum())} / {len(mask)} 项"
+        if min_spread_text and min_spread_pct is None:
+            status += " (价差输入无效，已忽略)"
+        self.search_status_var.set(status)
+
     def export_to_excel(self):
         if self.current_purchase_df.empty:
             messagebox.showerror("导出错误", "没有可导出的采购数据。")
             return
+        # 假设分析生效时导出当前模拟方案，否则导出原方案
+        if self.what_if_plan is not None:
+            export_purchase_df, export_grand_total, export_notes = self.what_if_plan
+        else:
+            export_purchase_df, export_grand_total, export_notes = self.current_purchase_df, self.last_run_grand_total_cost, self.last_run_notes_list
         try:
             today_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
             default_filename = f"{today_date_str}_采购清单.xlsx"
@@ -664,9 +1367,9 @@ class ProcurementApp:
             current_row = 2
             # grand_total_export = 0.0 # 使用 self.last_run_grand_total_cost
 
-            if not self.current_purchase_df.empty:
+            if not export_purchase_df.empty:
                 for chosen_sup_name in current_supplier_display_names_for_export:
-                    group_df = self.current_purchase_df[self.current_purchase_df['选择的供应商'] == chosen_sup_name]
+                    group_df = export_purchase_df[export_purchase_df['选择的供应商'] == chosen_sup_name]
                     if not group_df.empty:
                         supplier_total_amount = group_df['金额'].sum()
                         # grand_total_export += supplier_total_amount # 不再在这里累加，直接用保存的总额
@@ -706,11 +1409,11 @@ class ProcurementApp:
             # 写入总采购额和备注 (如果需要)
             ws.cell(row=current_row, column=len(headers) - 1, value="总采购额:").font = header_font
             ws.cell(row=current_row, column=len(headers) - 1).alignment = right_alignment
-            ws.cell(row=current_row, column=len(headers), value=f"{self.last_run_grand_total_cost:.2f}").font = header_font  # 使用保存的总额
+            ws.cell(row=current_row, column=len(headers), value=f"{export_grand_total:.2f}").font = header_font  # 使用保存的总额
             ws.cell(row=current_row, column=len(headers)).alignment = right_alignment
             current_row += 2
 
-            notes_to_export = self.last_run_notes_list
+            notes_to_export = export_notes
             if notes_to_export and (len(notes_to_export) > 1 or (len(notes_to_export) == 1 and notes_to_export[0] != "无特殊备注信息.")):
                 ws.cell(row=current_row, column=1, value="备注信息:").font = header_font
                 current_row += 1
@@ -719,7 +1422,7 @@ class ProcurementApp:
                     current_row += 1
 
             wb.save(save_path)
-            messagebox.showinfo("导出成功", "采购单已成功导出!")
+            messagebox.showinfo("导出成功", "采购单已成功导出!" + ("\n(导出的是当前假设分析方案)" if self.what_if_plan is not None else ""))
         except Exception as e:
             messagebox.showerror("导出失败", f"导出Excel失败: {e}")
 